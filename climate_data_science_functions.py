@@ -1,19 +1,18 @@
 import os
+import functools
+from collections import namedtuple
 import numpy as np
 import xarray as xr
-import scipy.signal as sps
 import pickle as pkl
 from warnings import catch_warnings,simplefilter
 
-import matplotlib as mpl
-import matplotlib.pyplot as plt
-import matplotlib.ticker as mticker
-import matplotlib.path as mpath
+# Matplotlib, Cartopy and Numba are imported inside the functions that
+# use them, so that the averaging helpers can be imported cheaply
 
-import cartopy
-import cartopy.crs as ccrs
-import cartopy.mpl.ticker as cticker
-from cartopy.util import add_cyclic_point
+
+# Projected y-coordinates of the south and north poles, keyed by
+# projection type and PROJ definition
+_ypole_cache = {}
 
 
 def add_cartopy_gridlines(ax,
@@ -45,19 +44,61 @@ def add_cartopy_gridlines(ax,
     
     Author: Ben Buchovecky
     '''
+    import matplotlib.ticker as mticker
+    import cartopy.crs as ccrs
+
     gl = ax.gridlines(linewidth=gridstyle['linewidth'],
                       linestyle=gridstyle['linestyle'],
                       color=gridstyle['color'])
     gl.ylocator = mticker.FixedLocator(lat)
     gl.xlocator = mticker.FixedLocator(lon)
 
-    _, y_btm = mapproj.transform_point(0, -90, ccrs.Geodetic())
-    _, y_top = mapproj.transform_point(0, 90, ccrs.Geodetic())
+    key = (type(mapproj).__name__, mapproj.proj4_init)
+    if key not in _ypole_cache:
+        _, y_btm = mapproj.transform_point(0, -90, ccrs.Geodetic())
+        _, y_top = mapproj.transform_point(0, 90, ccrs.Geodetic())
+        _ypole_cache[key] = (y_btm, y_top)
+    y_btm, y_top = _ypole_cache[key]
     ax.set_ylim(y_btm, y_top)
 
 
+# Extended longitudes and scratch data buffer used by cyclic_contourf.
+# The contours are computed when contourf is called, so a buffer can
+# be refilled for the next plot once that call returns.
+_CyclicGrid = namedtuple('_CyclicGrid', ['lon', 'buf'])
+
+
+@functools.lru_cache(maxsize=8)
+def _cyclic_grid(lon_bytes, lon_dtype, shape, dtype):
+    '''
+    Cached cyclic longitudes and data buffer for one longitude
+    coordinate and data shape/dtype.
+    '''
+    lon = np.frombuffer(lon_bytes, dtype=lon_dtype)
+    lon = np.append(lon, lon[0]+360)
+    lon.flags.writeable = False
+    return _CyclicGrid(lon, np.empty(shape[:-1]+(shape[-1]+1,), dtype))
+
+
+def _add_cyclic_point(values, lon, order=None):
+    '''
+    Writes values, optionally reordered along the last (lon) axis,
+    into a reused buffer with one extra column that repeats the first
+    column, and returns the buffer and the extended longitudes.
+    '''
+    nx = values.shape[-1]
+    grid = _cyclic_grid(lon.tobytes(), lon.dtype, values.shape, values.dtype)
+    if order is None:
+        grid.buf[..., :nx] = values
+    else:
+        np.take(values, order, axis=-1, out=grid.buf[..., :nx])
+    grid.buf[..., nx] = grid.buf[..., 0]
+    return grid.buf, grid.lon
+
+
 def cyclic_contourf(ax,
                     da,
+                    fast=False,
                     **kwargs):
     '''
     Adds a cyclic point and creates a filled contour plot.
@@ -68,6 +109,14 @@ def cyclic_contourf(ax,
         Cartopy geoaxis object.
     da : xarray.DataArray
         DataArray with lat and lon coordinates.
+    fast : bool
+        If True and ax is a Cartopy geoaxis, project the lat/lon points
+        to the map projection once and contour in projection space,
+        which is much faster than transforming every contour path for
+        non-PlateCarree projections. Any transform keyword is ignored
+        and da is assumed to be on a regular lat/lon grid. Projections
+        that cannot show the whole globe (e.g. Orthographic) use the
+        regular path.
     
     Returns:
     --------
@@ -76,7 +125,37 @@ def cyclic_contourf(ax,
     
     Author: Ben Buchovecky
     '''
-    data,lon = add_cyclic_point(da, coord=da.lon)
+    import matplotlib as mpl
+
+    # Matplotlib >= 3.6 can use the faster ContourPy serial algorithm
+    if 'contour.algorithm' in mpl.rcParams:
+        kwargs.setdefault('algorithm', 'serial')
+
+    if fast and hasattr(ax, 'projection'):
+        import cartopy.crs as ccrs
+
+        # Center the longitudes on the projection's central meridian
+        # (lon_0, plus the prime meridian shift pm used by PlateCarree)
+        # and keep the edge columns just inside the antimeridian, so
+        # the mesh does not fold at the edges of the map. This is done
+        # in float64, since 180-1e-6 rounds to 180 in float32
+        params = ax.projection.proj4_params
+        lon0 = params.get('lon_0', 0)+params.get('pm', 0)
+        lon = (da.lon.values.astype(np.float64)-lon0+180) % 360-180
+        order = np.argsort(lon)
+        data, lon = _add_cyclic_point(da.values, lon[order], order)
+        lon = np.clip(lon, -180+1e-6, 180-1e-6)+lon0
+        LON, LAT = np.meshgrid(lon, da.lat.values)
+        xyz = ax.projection.transform_points(ccrs.PlateCarree(), LON, LAT)
+        # Points the projection cannot show (e.g. the far side of an
+        # orthographic globe) come back non-finite, and only the
+        # transform path below clips those correctly
+        if np.isfinite(xyz[..., :2]).all():
+            kwargs.pop('transform', None)
+            return ax.contourf(xyz[..., 0], xyz[..., 1], data,
+                               transform=ax.transData, **kwargs)
+
+    data,lon = _add_cyclic_point(da.values, da.lon.values)
     cf = ax.contourf(lon, da.lat, data, **kwargs)
     return cf
 
@@ -98,18 +177,136 @@ def symmetric_y_axis(ax):
     
     Author: Ben Buchovecky
     '''
-   
-    ax.set_ylim(-max(np.abs(ax.get_ylim())), max(np.abs(ax.get_ylim())))
+    lo, hi = ax.get_ylim()
+    lim = max(abs(lo), abs(hi))
+    if lo > hi:
+        ax.set_ylim(lim, -lim)
+    else:
+        ax.set_ylim(-lim, lim)
+
+
+# Chunks used when opening NetCDF files passed to the averaging helpers
+_OPEN_CHUNKS = {'time': 'auto', 'lat': -1, 'lon': -1}
+
+
+def _is_path(obj):
+    '''
+    Returns True if obj is a path or a list of paths.
+    '''
+    if isinstance(obj, list):
+        return len(obj) > 0 and all(isinstance(p, (str, os.PathLike)) for p in obj)
+    return isinstance(obj, (str, os.PathLike))
+
+
+def _open_dataset(paths):
+    '''
+    Lazily opens one or more NetCDF files (or a glob) as a single
+    dask-backed dataset, chunked along time with whole lat/lon slabs.
+    '''
+    return xr.open_mfdataset(paths, chunks=_OPEN_CHUNKS, combine='by_coords')
+
+
+def _as_dataarray(da, varname=None):
+    '''
+    Returns da, or variable varname of the files if da is a path.
+    '''
+    if not _is_path(da):
+        return da
+    if varname is None:
+        raise ValueError('varname is required when da is a path')
+    return _open_dataset(da)[varname]
+
+
+# In-memory arrays larger than this are chunked along time before reducing
+_AUTO_CHUNK_NBYTES = 512*1024*1024
+
+
+def _maybe_chunk(da, chunks=None):
+    '''
+    Returns a dask-backed view of da so that reductions stream over
+    chunks. Explicit chunks are always applied, otherwise in-memory
+    arrays larger than _AUTO_CHUNK_NBYTES are chunked along time.
+    '''
+    if chunks is not None:
+        return da.chunk(chunks)
+    if da.chunks is None and da.nbytes > _AUTO_CHUNK_NBYTES and 'time' in da.dims:
+        return da.chunk({'time': 'auto'})
+    return da
+
+
+def _lat_weights(lat):
+    '''
+    Latitude area weights for an array of latitude centers, cached
+    on the raw bytes of the latitudes.
+    '''
+    return _sin_bounds_weights(lat.tobytes(), lat.dtype)
+
+
+@functools.lru_cache(maxsize=32)
+def _sin_bounds_weights(lat_bytes, lat_dtype):
+    '''
+    Cached latitude area weights for the raw bytes of latitude centers,
+    returned as a DataArray on the lat dimension.
+
+    The weight of each cell is sin(lat_upper) - sin(lat_lower), with
+    the cell bounds at the midpoints between latitudes (extrapolated at
+    the edges and clipped to the poles), divided by the mean spacing in
+    radians so that the weights approach cos(lat) for fine grids. This
+    also holds for non-uniform grids such as Gaussian grids. Fewer than
+    three latitudes are too few to tell a grid from a subset of one, so
+    they are weighted by cos(lat).
+    '''
+    lat = np.frombuffer(lat_bytes, dtype=lat_dtype)
+    if lat.size < 3:
+        w = np.cos(np.deg2rad(lat))
+    else:
+        step = np.diff(lat)
+        bnds = np.concatenate([[lat[0]-step[0]/2], lat[:-1]+step/2,
+                               [lat[-1]+step[-1]/2]])
+        bnds = np.sin(np.deg2rad(np.clip(bnds, -90, 90)))
+        w = np.abs(np.diff(bnds))/np.deg2rad(np.abs(step).mean())
+    return xr.DataArray(w, coords={'lat': lat}, dims='lat')
+
+
+@functools.lru_cache(maxsize=None)
+def _numexpr():
+    '''
+    Returns the numexpr module, or None if it is not installed.
+    '''
+    try:
+        import numexpr
+    except ImportError:
+        return None
+    return numexpr
+
+
+def _numexpr_multiply(a, w, out):
+    '''
+    Multithreaded a*w written into out, with numexpr.
+    '''
+    return _numexpr().evaluate('a*w', local_dict={'a': a, 'w': w},
+                               out=out, casting='same_kind')
 
 
-def coslat_area_avg(da):
+def coslat_area_avg(da, chunks=None, varname=None):
     '''
-    Computes the cosine(latitude) weighted average.
+    Computes the cosine(latitude) weighted average, using the exact
+    cell area weights sin(lat_upper) - sin(lat_lower). The zonal mean
+    is reduced over latitude in a single weighted dot product and
+    normalized by the sum of the weights at non-missing latitudes.
 
     Parameters:
     -----------
-    da : xr.DataArray
-        Lat/lon gridded data array
+    da : xr.DataArray, str, os.PathLike or list
+        Lat/lon gridded data array, or NetCDF file path(s) to open
+        lazily with dask
+    chunks : dict, optional
+        Dask chunks to apply to da before reducing. By default, only
+        in-memory arrays larger than 512 MiB are chunked along time.
+        When doing many reductions of the same large array, pass an
+        already chunked array to avoid rechunking on every call.
+    varname : str, optional
+        Name of the variable to use when da is a path
         
     Returns:
     --------
@@ -118,18 +315,39 @@ def coslat_area_avg(da):
         
     Author: Ben Buchovecky
     '''
-    lat = da.lat
-    return (da.mean(dim='lon')*np.cos(np.deg2rad(lat))).mean(dim='lat')
+    da = _as_dataarray(da, varname)
+    da = _maybe_chunk(da, chunks)
+    w = _lat_weights(da.lat.values)
+    zonal = da.mean(dim='lon')
+    return xr.dot(zonal.fillna(0), w) / xr.dot(zonal.notnull(), w)
 
 
-def coslat_weight(da):
+def coslat_weight(da, chunks=None, out=None, inplace=False, varname=None):
     '''
-    Weights a lat/lon gridded array with cosine(latitude)
+    Weights a lat/lon gridded array with cosine(latitude), using the
+    exact cell area weights sin(lat_upper) - sin(lat_lower) scaled by
+    the latitude spacing
 
     Parameters:
     -----------
-    da : xr.DataArray
-        Lat/lon gridded data array
+    da : xr.DataArray, str, os.PathLike or list
+        Lat/lon gridded data array, or NetCDF file path(s) to open
+        lazily with dask
+    chunks : dict, optional
+        Dask chunks to apply to da before weighting. By default, only
+        in-memory arrays larger than 512 MiB are chunked along time.
+    out : np.ndarray, optional
+        Array with the same shape as da to write the weighted values
+        into, avoiding a new allocation for in-memory data. Ignored if
+        the weighted values cannot be cast to its dtype.
+    inplace : bool
+        If True, multiply the in-memory values of da in place and
+        return da. Any object sharing its data is also modified.
+        Dask-backed data is instead weighted lazily chunk by chunk,
+        and read-only or integer data is weighted into out or a new
+        array.
+    varname : str, optional
+        Name of the variable to use when da is a path
         
     Returns:
     --------
@@ -138,8 +356,222 @@ def coslat_weight(da):
         
     Author: Ben Buchovecky
     '''
-    lat = da.lat
-    return da*np.cos(np.deg2rad(lat))
+    da = _as_dataarray(da, varname)
+    w = _lat_weights(da.lat.values)
+    if inplace or out is not None:
+        if da.chunks is None:
+            da.load()
+        values = da.data
+        if isinstance(values, np.ndarray):
+            shape = [1]*da.ndim
+            shape[da.get_axis_num('lat')] = -1
+            w_shaped = w.values.reshape(shape)
+            multiply = _numexpr_multiply if _numexpr() is not None else np.multiply
+            dtype = np.result_type(values.dtype, w.dtype)
+            if (inplace and values.flags.writeable
+                    and np.can_cast(dtype, values.dtype, 'same_kind')):
+                multiply(values, w_shaped, out=values)
+                return da
+            if out is not None and np.can_cast(dtype, out.dtype, 'same_kind'):
+                multiply(values, w_shaped, out=out)
+                return da.copy(data=out)
+    da = _maybe_chunk(da, chunks)
+    return da*w
+
+
+def zonal_mean(da, lat_bins, chunks=None, varname=None):
+    '''
+    Computes the area weighted zonal mean within latitude bins. The
+    weighted zonal means and weights are summed within each bin with
+    xarray's groupby_bins, which uses flox when it is installed.
+
+    Parameters:
+    -----------
+    da : xr.DataArray, str, os.PathLike or list
+        Lat/lon gridded data array, or NetCDF file path(s) to open
+        lazily with dask
+    lat_bins : array-like
+        Edges of the latitude bins, as in xr.DataArray.groupby_bins
+    chunks : dict, optional
+        Dask chunks to apply to da before reducing. By default, only
+        in-memory arrays larger than 512 MiB are chunked along time.
+    varname : str, optional
+        Name of the variable to use when da is a path
+
+    Returns:
+    --------
+    zm : xr.DataArray
+        Zonal mean data array with a lat_bins dimension
+
+    Author: Ben Buchovecky
+    '''
+    da = _as_dataarray(da, varname)
+    da = _maybe_chunk(da, chunks)
+    w = _lat_weights(da.lat.values)
+    zonal = da.mean(dim='lon')
+    num = zonal.fillna(0)*w
+    den = zonal.notnull()*w
+    return (num.groupby_bins('lat', lat_bins).sum()
+            / den.groupby_bins('lat', lat_bins).sum())
+
+
+def _lat_band(da, lat_bnds):
+    '''
+    Selects the latitudes within lat_bnds, for ascending or descending
+    latitude coordinates.
+    '''
+    lo, hi = min(lat_bnds), max(lat_bnds)
+    return da.isel(lat=((da.lat >= lo) & (da.lat <= hi)).values)
+
+
+def weighted_average(da, weights, lat_bnds=(-90, 90), chunks=None, varname=None):
+    '''
+    Computes the weighted average over lat/lon within a latitude band
+    with xarray's weighted mean, which computes the weighted sum and
+    the sum of the weights at non-missing points as dot products.
+
+    Parameters:
+    -----------
+    da : xr.DataArray, str, os.PathLike or list
+        Lat/lon gridded data array, or NetCDF file path(s) to open
+        lazily with dask
+    weights : xr.DataArray
+        Lat/lon gridded weights (e.g. cell area times land fraction),
+        missing weights are treated as zero
+    lat_bnds : tuple
+        Lower and upper latitude bounds of the averaging region
+    chunks : dict, optional
+        Dask chunks to apply to da before reducing. By default, only
+        in-memory arrays larger than 512 MiB are chunked along time.
+        When doing many reductions of the same large array, pass an
+        already chunked array to avoid rechunking on every call.
+    varname : str, optional
+        Name of the variable to use when da is a path
+
+    Returns:
+    --------
+    avg : xr.DataArray
+        Weighted average data array
+
+    Author: Ben Buchovecky
+    '''
+    da = _as_dataarray(da, varname)
+    da = _maybe_chunk(da, chunks)
+    da = _lat_band(da, lat_bnds)
+    weights = _lat_band(weights, lat_bnds).fillna(0)
+    return da.weighted(weights).mean(dim=['lat', 'lon'])
+
+
+def weighted_average_batch(data, weights, lat_bnds=(-90, 90), chunks=None):
+    '''
+    Computes weighted_average for several variables at once. Variables
+    with the same dimensions are stacked along a new var dimension so
+    that they are reduced together, as a single dask graph for dask
+    inputs.
+
+    Parameters:
+    -----------
+    data : xr.Dataset, dict or list of xr.DataArray, str, os.PathLike or list
+        Variables on a common lat/lon grid, or NetCDF file path(s) to
+        open lazily with dask. Only Dataset variables with lat and lon
+        dimensions are used and list entries are named by their name
+        attribute, which must be set and unique
+    weights : xr.DataArray
+        Lat/lon gridded weights (e.g. cell area times land fraction),
+        missing weights are treated as zero
+    lat_bnds : tuple
+        Lower and upper latitude bounds of the averaging region
+    chunks : dict, optional
+        Dask chunks to apply to the stacked variables before reducing
+
+    Returns:
+    --------
+    avg : xr.Dataset
+        Weighted average of each variable
+
+    Author: Ben Buchovecky
+    '''
+    if _is_path(data):
+        data = _open_dataset(data)
+    if isinstance(data, xr.Dataset):
+        data = {name: da for name, da in data.data_vars.items()
+                if 'lat' in da.dims and 'lon' in da.dims}
+    elif not isinstance(data, dict):
+        names = [da.name for da in data]
+        if None in names or len(set(names)) != len(names):
+            raise ValueError('DataArrays passed as a list must have unique names')
+        data = dict(zip(names, data))
+    # Stack only variables with the same dims, so that e.g. a static or
+    # surface field is not broadcast along the time or level dimension
+    groups = {}
+    for name, da in data.items():
+        groups.setdefault(da.dims, []).append(name)
+    avg = {}
+    for names in groups.values():
+        stacked = xr.concat([data[name] for name in names], dim='var',
+                            coords='minimal', compat='override')
+        stacked = stacked.assign_coords(var=names)
+        avg.update(weighted_average(stacked, weights, lat_bnds, chunks)
+                   .to_dataset(dim='var').data_vars)
+    return xr.Dataset({name: avg[name] for name in data})
+
+
+# Below this many elements symmetric_cf_levels uses NumPy, since the
+# kernel's savings would not cover the ~0.5 s to import Numba and load
+# the cached kernel
+_NUMBA_MIN_SIZE = 2**24
+
+
+@functools.lru_cache(maxsize=None)
+def _finite_abs_std_kernel():
+    '''
+    Compiles the Numba kernel used by symmetric_cf_levels on first
+    use, or returns None if Numba is not installed. The compiled
+    kernel is cached on disk so later processes skip the compilation.
+    '''
+    try:
+        from numba import njit, prange
+    except ImportError:
+        return None
+
+    # Every fastmath flag except nnan/ninf, which would let the
+    # compiler drop the NaN checks
+    @njit(parallel=True, cache=True,
+          fastmath={'reassoc', 'nsz', 'arcp', 'contract', 'afn'})
+    def _finite_abs_std(a):
+        '''
+        Computes nanstd(a) of a 1-D array with two parallel passes
+        (mean, then squared deviations) and gathers abs(a) of the
+        non-missing values into a new buffer.
+        '''
+        count = 0
+        total = 0.0
+        for i in prange(a.size):
+            x = a[i]
+            if not np.isnan(x):
+                count += 1
+                total += x
+        finite = np.empty(count, dtype=a.dtype)
+        if count == 0:
+            return finite, np.nan
+        mean = total/count
+
+        sqdev = 0.0
+        for i in prange(a.size):
+            x = a[i]
+            if not np.isnan(x):
+                sqdev += (x-mean)*(x-mean)
+        std = np.sqrt(sqdev/count)
+
+        j = 0
+        for i in range(a.size):
+            x = a[i]
+            if not np.isnan(x):
+                finite[j] = abs(x)
+                j += 1
+        return finite, std
+
+    return _finite_abs_std
 
 
 def symmetric_cf_levels(da, nlevels):
@@ -159,7 +591,21 @@ def symmetric_cf_levels(da, nlevels):
 
     Author: Ben Buchovecky
     '''
-    flattened = da.values.flatten()
-    lim = np.nanmedian(abs(flattened))+3*np.nanstd(flattened)
+    flattened = da.values.ravel()
+    kernel = None
+    if flattened.dtype in (np.float32, np.float64) and flattened.size >= _NUMBA_MIN_SIZE:
+        kernel = _finite_abs_std_kernel()
+    if kernel is not None:
+        finite, std = kernel(flattened)
+        lim = np.median(finite, overwrite_input=True)+3*std
+    else:
+        # Bottleneck's nanstd accumulates float32 input in float32,
+        # which loses most of its precision on large fields, so it is
+        # only used for the median
+        try:
+            from bottleneck import nanmedian
+        except ImportError:
+            nanmedian = np.nanmedian
+        lim = nanmedian(np.abs(flattened))+3*np.nanstd(flattened)
     levels = np.linspace(-lim, lim, nlevels)
     return levels
\ No newline at end of file
@@ -0,0 +1,27 @@
+import numpy as np
+import xarray as xr
+
+import climate_data_science_functions as cdsf
+
+
+def test_weighted_average_batch_mixed_dims():
+    lat = np.linspace(-90, 90, 24)
+    lon = np.arange(0, 360, 15.)
+    rng = np.random.default_rng(0)
+    ds = xr.Dataset(
+        {'T': (('lev', 'time', 'lat', 'lon'), rng.random((3, 4, 24, 24))),
+         'PS': (('time', 'lat', 'lon'), rng.random((4, 24, 24))),
+         's': (('lat', 'lon'), rng.random((24, 24)))},
+        coords={'lev': np.arange(3), 'time': np.arange(4), 'lat': lat, 'lon': lon})
+    weights = xr.DataArray(rng.random((24, 24)), coords={'lat': lat, 'lon': lon},
+                           dims=('lat', 'lon'))
+
+    avg = cdsf.weighted_average_batch(ds, weights, lat_bnds=(-60, 60))
+
+    assert list(avg.data_vars) == ['T', 'PS', 's']
+    assert avg['T'].dims == ('lev', 'time')
+    assert avg['PS'].dims == ('time',)
+    assert avg['s'].dims == ()
+    for name in avg.data_vars:
+        expected = cdsf.weighted_average(ds[name], weights, lat_bnds=(-60, 60))
+        np.testing.assert_allclose(avg[name], expected)